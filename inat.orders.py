@@ -2,7 +2,7 @@
 
 # inat.orders.py 
 
-# version 1.3
+# version 1.4
 
 # A python script that summarizes the orders (taxonomic rank) of iNaturalist observations - and optionally adds a summary of the families
 # Useful for generating the data needed for a transportation permit to get scientific collections into a herbarium
@@ -18,37 +18,198 @@ import sys
 import requests
 import time
 import argparse
+import atexit
+import heapq
+import threading
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib.parse import quote
+
+# Ask the API for just the fields we actually read instead of the full
+# observation payload (photos, identifications, comments, geoprivacy...),
+# which shrinks the responses by an order of magnitude or more.  The same
+# fieldset covers both the taxonomy and the --users mode so the URLs stay
+# identical and cacheable.
+OBSERVATION_FIELDS = quote("(taxon:(id,name,rank,ancestry,ancestors:(id,name,rank)),user:(name,login))")
+
+# The taxa endpoints only need enough to identify a rank by name
+TAXA_FIELDS = quote("(id,name,rank)")
+
+# Pre-built templates for the per-observation output lines - filling in a
+# module-level template with % is a little cheaper than building a fresh
+# f-string on every iteration of the hot loop
+ORDER_LINE = "%s: %s"
+FAMILY_LINE = "%s: Order: %s Family: %s"
+FAMILY_UNKNOWN_LINE = "%s: Order: %s Family: Unknown"
+USER_LINE = "%s: %s: %s"
+RANK_LINE = "%s: %s: %s"
+ERROR_LINE = "%s: Error - %s"
+
+def find_ranks_in_ancestors(ancestors, include_family, order_name=None, family_name=None):
+    """
+    Pulls the order and (optionally) family names out of an ordered ancestor
+    list.  The chain runs root to leaf, so order - which sits near the root -
+    is searched front to back, while family - which sits near the leaf - is
+    searched back to front, each stopping at the first hit.
+    """
+    if not order_name:
+        for ancestor in ancestors:
+            if ancestor.get('rank') == 'order':
+                order_name = ancestor.get('name')
+                break
+    if include_family and not family_name:
+        for ancestor in reversed(ancestors):
+            if ancestor.get('rank') == 'family':
+                family_name = ancestor.get('name')
+                break
+    return order_name, family_name
+
+# orjson parses big JSON responses (like a 200-observation batch) several
+# times faster than the stdlib parser - use it when it's installed
+try:
+    import orjson
+    def parse_json(response):
+        return orjson.loads(response.content)
+except ImportError:
+    import json
+    def parse_json(response):
+        # json.loads takes the response bytes directly, skipping the
+        # encoding-detection work that response.json() does first
+        return json.loads(response.content)
+
+# Use a persistent on-disk cache when requests-cache is installed - taxonomy
+# records essentially never change, so a second run over an overlapping set of
+# observations can skip most of the network entirely.  The cache keeps entries
+# for 30 days.  If requests-cache isn't installed we just use a plain session.
+try:
+    import requests_cache
+    # cache_control=True makes expired entries revalidate with a conditional
+    # GET (If-None-Match / If-Modified-Since) - a 304 costs almost no
+    # bandwidth or parse time and refreshes the cached copy
+    SESSION = requests_cache.CachedSession('inat_cache', backend='sqlite',
+                                           allowable_methods=('GET',),
+                                           cache_control=True,
+                                           expire_after=30 * 86400)
+    HAVE_REQUESTS_CACHE = True
+except ImportError:
+    SESSION = requests.Session()
+    HAVE_REQUESTS_CACHE = False
+
+# Reuse one HTTPS connection to api.inaturalist.org instead of doing a new
+# TCP + TLS handshake for every API call - all of our traffic goes to a single
+# host, so keep-alive saves a round trip or two on each request.  A pool of
+# HTTP/1.1 keep-alive connections is plenty here: the rate limiter keeps only
+# a handful of requests in flight at once, so HTTP/2 multiplexing (which would
+# mean switching to httpx and losing the requests-cache integration) wouldn't
+# buy anything
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+SESSION.headers.update({
+    'User-Agent': 'inat.orders.py/1.4 (https://github.com/AlanRockefeller/inat.orders.py)',
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip',
+})
+atexit.register(SESSION.close)
 
 # The iNaturalist API doesn't like it when there is more than one request per second
 class RateLimiter:
     """
     Manages API request timing to respect rate limits.
+
+    Implemented as a token bucket: tokens refill at one per current_delay
+    seconds up to a small burst capacity, and each request takes one token.
+    Short bursts can go out back to back (the API's limit is per minute,
+    not per second) while the average rate stays at one request per
+    current_delay seconds - unlike a fixed gap, idle time between requests
+    isn't wasted.
+
+    current_delay itself adapts AIMD-style: when the API's
+    X-RateLimit-Remaining header shows plenty of headroom the delay shrinks
+    additively (never below 60% of the configured delay, which matches
+    iNaturalist's 100 requests/minute cap at the default settings), and on a
+    429 it grows multiplicatively.
     """
-    def __init__(self, min_delay=1.0, debug=False):
+    def __init__(self, min_delay=1.0, debug=False, capacity=10):
         self.min_delay = min_delay
-        self.last_call_time = 0
+        self.current_delay = min_delay
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.time()
         self.call_count = 0
         self.debug = debug
+        # Worker threads share this limiter, so the token bookkeeping
+        # needs to happen under a lock.  Holding the lock while sleeping is
+        # intentional - it serializes when requests are *sent*, but not how
+        # long each thread then waits for its response.
+        self._lock = threading.Lock()
 
-    def wait_and_increment(self):
+    def set_min_delay(self, min_delay):
         """
-        Waits if necessary to respect the rate limit, then marks a new API call.
+        Updates the configured delay, resetting any adaptive adjustment.
         """
-        now = time.time()
-        elapsed = now - self.last_call_time
+        with self._lock:
+            if min_delay != self.min_delay:
+                self.min_delay = min_delay
+                self.current_delay = min_delay
 
-        # If this isn't the first call and we haven't waited long enough
-        if self.last_call_time > 0 and elapsed < self.min_delay:
-            wait_time = self.min_delay - elapsed
+    def record_success(self, remaining_header):
+        """
+        Additive increase: speeds up a little when the API reports plenty
+        of rate-limit headroom.
+        """
+        if remaining_header is None:
+            return
+        try:
+            remaining = int(remaining_header)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            if remaining > 10:
+                floor = self.min_delay * 0.6
+                if self.current_delay > floor:
+                    self.current_delay = max(floor, self.current_delay - 0.05)
+
+    def record_throttle(self):
+        """
+        Multiplicative decrease: backs off hard after a 429.
+        """
+        with self._lock:
+            self.current_delay = min(10.0, max(self.min_delay, self.current_delay * 2))
+            # Drain the bucket too - no more bursting right after a 429
+            self.tokens = min(self.tokens, 1.0)
             if self.debug:
-                print(f"Rate limiting: waiting {wait_time:.2f} seconds...", file=sys.stderr)
-            time.sleep(wait_time)
+                print(f"Rate limited by the API - slowing down to one request every {self.current_delay:.2f} seconds", file=sys.stderr)
 
-        # Update the last call time after waiting (if needed)
-        self.last_call_time = time.time()
-        self.call_count += 1
+    def wait_and_increment(self):
+        """
+        Takes a token from the bucket, waiting for one to refill if the
+        bucket is empty, then marks a new API call.
+        """
+        with self._lock:
+            if self.current_delay <= 0:
+                self.call_count += 1
+                return
+
+            # Refill the bucket for the time that has passed since last look
+            now = time.time()
+            rate = 1.0 / self.current_delay
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * rate)
+            self.last_refill = now
+
+            # If the bucket is empty, sleep until one token has dripped in
+            if self.tokens < 1.0:
+                wait_time = (1.0 - self.tokens) / rate
+                if self.debug:
+                    print(f"Rate limiting: waiting {wait_time:.2f} seconds...", file=sys.stderr)
+                time.sleep(wait_time)
+                self.last_refill = time.time()
+                self.tokens = 1.0
+
+            self.tokens -= 1.0
+            self.call_count += 1
 
     def get_count(self):
         """
@@ -59,25 +220,48 @@ class RateLimiter:
 # Global rate limiter instance (debug will be set in main)
 rate_limiter = RateLimiter()
 
+def url_is_cached(url):
+    """
+    Returns True if the URL has a fresh entry in the persistent cache,
+    so the request won't actually go over the wire.
+    """
+    if not HAVE_REQUESTS_CACHE:
+        return False
+    try:
+        return SESSION.cache.contains(url=url)
+    except Exception:
+        return False
+
 def make_api_request(url, min_delay=1.0, retries=3, retry_delay=2.0):
     """
     Makes an API request with rate limiting and retry logic.
     """
-    rate_limiter.min_delay = min_delay  # Update the rate limiter's delay setting
+    rate_limiter.set_min_delay(min_delay)  # Update the rate limiter's delay setting
 
     for attempt in range(retries):
-        # Wait as needed to respect rate limits
-        rate_limiter.wait_and_increment()
+        # Wait as needed to respect rate limits - unless the response is
+        # going to come out of the on-disk cache, in which case nothing
+        # goes over the wire and there is no reason to throttle
+        if not url_is_cached(url):
+            rate_limiter.wait_and_increment()
 
         try:
-            response = requests.get(url)
+            response = SESSION.get(url, timeout=30)
             response.raise_for_status()
-            return response.json()
+            # Let the limiter speed up a little when the API says we have headroom
+            rate_limiter.record_success(response.headers.get('x-ratelimit-remaining'))
+            return parse_json(response)
         except requests.exceptions.HTTPError as e:
             if response.status_code == 429 and attempt < retries - 1:
+                rate_limiter.record_throttle()
+                # Honor the server's Retry-After if it sent one, otherwise back off exponentially
+                try:
+                    wait = max(float(response.headers.get('retry-after', 0)), retry_delay * (attempt + 1))
+                except (TypeError, ValueError):
+                    wait = retry_delay * (attempt + 1)
                 if rate_limiter.debug:
-                    print(f"Rate limit exceeded. Waiting {retry_delay * (attempt + 1)} seconds...", file=sys.stderr)
-                time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
+                    print(f"Rate limit exceeded. Waiting {wait} seconds...", file=sys.stderr)
+                time.sleep(wait)
                 continue
             # If it's not a rate limit or we're out of retries, re-raise
             raise e
@@ -85,11 +269,35 @@ def make_api_request(url, min_delay=1.0, retries=3, retry_delay=2.0):
             # For any other exception, re-raise
             raise e
 
+# Taxa fetched earlier in the run, keyed by taxon ID string.  Observations in
+# a batch tend to share most of their upper taxonomy (same kingdom, phylum,
+# class...), so after the first few observations most ancestors are already here.
+taxon_cache = {}
+
+@lru_cache(maxsize=4096)
+def _get_taxon_cached(taxon_id):
+    """
+    Fetches a single taxon, memoized so repeated lookups of the same ID
+    (common high-level ancestors) cost nothing after the first call.
+    """
+    url = f"https://api.inaturalist.org/v1/taxa/{taxon_id}?fields={TAXA_FIELDS}"
+    return make_api_request(url, rate_limiter.min_delay)
+
 def get_taxon_info(taxon_id, min_delay=1.0):
     """
     Fetches information about a specific taxon ID from the iNaturalist API
     """
-    url = f"https://api.inaturalist.org/v1/taxa/{taxon_id}"
+    rate_limiter.set_min_delay(min_delay)
+    return _get_taxon_cached(str(taxon_id))
+
+def get_taxa_bulk(taxon_ids, min_delay=1.0):
+    """
+    Fetches information about multiple taxon IDs in a single request.
+    The taxa endpoint accepts a comma-separated list of IDs, so a whole
+    ancestry chain costs one API call instead of one per ancestor.
+    """
+    ids_param = ','.join(str(t) for t in taxon_ids)
+    url = f"https://api.inaturalist.org/v1/taxa/{ids_param}?per_page={max(30, len(taxon_ids))}&fields={TAXA_FIELDS}"
     return make_api_request(url, min_delay)
 
 def get_observations_batch(observation_ids, min_delay=1.0, per_page=200):
@@ -99,7 +307,7 @@ def get_observations_batch(observation_ids, min_delay=1.0, per_page=200):
     """
     # Join the IDs with commas for the API query
     ids_param = ','.join(observation_ids)
-    url = f"https://api.inaturalist.org/v1/observations?per_page={per_page}&id={ids_param}"
+    url = f"https://api.inaturalist.org/v1/observations?per_page={per_page}&id={ids_param}&fields={OBSERVATION_FIELDS}"
     return make_api_request(url, min_delay)
 
 def get_observation_taxonomy(observation_id, min_delay=1.0, include_family=False, batch_data=None):
@@ -110,29 +318,41 @@ def get_observation_taxonomy(observation_id, min_delay=1.0, include_family=False
     If batch_data is provided, it will use that instead of making a new API call.
     """
     try:
-        # Use batch data if provided, otherwise make a single API call
+        # Use batch data if provided - an ID the batch response didn't
+        # include falls through to an individual retry below
+        observation = None
         if batch_data:
             # Find the observation in the batch data
-            observation = None
             for result in batch_data.get('results', []):
                 if str(result.get('id')) == str(observation_id):
                     observation = result
                     break
-                    
-            if not observation:
-                return (None, None, "Observation not found in batch data", None, None)
-                
-            taxon = observation.get('taxon')
-        else:
+
+        if observation is None:
             # Make a single API call for this observation
-            url = f"https://api.inaturalist.org/v1/observations/{observation_id}"
+            url = f"https://api.inaturalist.org/v1/observations/{observation_id}?fields={OBSERVATION_FIELDS}"
             data = make_api_request(url, min_delay)
-            
+
             if not data.get('results') or len(data['results']) == 0:
                 return (None, None, "No results found", None, None)
-                
-            taxon = data['results'][0].get('taxon')
-            
+
+            observation = data['results'][0]
+
+        return extract_taxonomy(observation.get('taxon'), min_delay, include_family)
+
+    except requests.exceptions.RequestException as e:
+        return (None, None, f"API request failed: {str(e)}", None, None)
+    except Exception as e:
+        return (None, None, f"Error processing observation: {str(e)}", None, None)
+
+def extract_taxonomy(taxon, min_delay=1.0, include_family=False):
+    """
+    Resolves the order (and optionally family) from an already-fetched taxon
+    dict, as found in an observation response.  Only goes back to the network
+    if the ancestry chain has to be looked up.
+    Returns the same tuple as get_observation_taxonomy.
+    """
+    try:
         if not taxon:
             return (None, None, "No taxonomic information available", None, None)
 
@@ -150,33 +370,93 @@ def get_observation_taxonomy(observation_id, min_delay=1.0, include_family=False
         elif current_rank == 'family':
             family_name = current_rank_name
 
-        # Get the ancestry chain
-        ancestry = taxon.get('ancestry')
-        if not ancestry:
-            return (order_name, family_name, "No ancestry information available", current_rank, current_rank_name)
-
-        # Split the ancestry into IDs
-        ancestor_ids = ancestry.split('/')
-
-        # If the current taxon is not an order or family, we need to check ancestors
-        if not order_name or (include_family and not family_name):
+        # The observation payload usually embeds the full ancestor list with
+        # id, rank and name for every ancestor, so order and family can
+        # normally be resolved without any additional API calls
+        ancestors = taxon.get('ancestors')
+        if ancestors:
+            # Seed the run-wide cache (keys are always ID strings) so other
+            # observations that have to fall back to the ancestry-ID path can
+            # resolve these taxa without touching the network
+            for ancestor in ancestors:
+                ancestor_id = ancestor.get('id')
+                if ancestor_id is not None:
+                    taxon_cache.setdefault(str(ancestor_id), ancestor)
+
+        if ancestors and (not order_name or (include_family and not family_name)):
+            order_name, family_name = find_ranks_in_ancestors(
+                ancestors, include_family, order_name, family_name
+            )
+
+        # Only hit the network if no embedded ancestor list was available -
+        # refetching the same chain wouldn't tell us anything new
+        if (not order_name or (include_family and not family_name)) and not ancestors:
+            # Get the ancestry chain and split it straight into IDs - the two
+            # payload variants just use different delimiters, so split on the
+            # native one rather than rewriting the string first
+            ancestry = taxon.get('ancestry')
+            if ancestry:
+                ancestor_ids = ancestry.split('/')
+            else:
+                # Some payloads carry the chain as a comma-separated ID string instead
+                ancestry = taxon.get('min_species_ancestry')
+                if not ancestry:
+                    return (order_name, family_name, "No ancestry information available", current_rank, current_rank_name)
+                ancestor_ids = ancestry.split(',')
+
+            # Reuse any ancestors we have already fetched during this run, then
+            # fetch whatever is still missing in a single bulk request rather
+            # than one API call (and one rate-limit wait) per ancestor
+            ancestors_by_id = {}
+            missing_ids = []
             for ancestor_id in ancestor_ids:
+                cached = taxon_cache.get(ancestor_id)
+                if cached is not None:
+                    ancestors_by_id[ancestor_id] = cached
+                else:
+                    missing_ids.append(ancestor_id)
+
+            if missing_ids:
                 try:
-                    ancestor_info = get_taxon_info(ancestor_id, min_delay)
-                    if (ancestor_info.get('results') and len(ancestor_info['results']) > 0):
-                        ancestor_rank = ancestor_info['results'][0].get('rank')
-                        if ancestor_rank == 'order' and not order_name:
-                            order_name = ancestor_info['results'][0].get('name')
-                        elif include_family and ancestor_rank == 'family' and not family_name:
-                            family_name = ancestor_info['results'][0].get('name')
-
-                        # If we have found both required taxonomic ranks, we can stop searching
-                        if order_name and (not include_family or family_name):
-                            break
+                    ancestors_info = get_taxa_bulk(missing_ids, min_delay)
+                    for result in ancestors_info.get('results', []):
+                        result_id = str(result.get('id'))
+                        ancestors_by_id[result_id] = result
+                        taxon_cache[result_id] = result
                 except Exception as e:
                     if rate_limiter.debug:
-                        print(f"Warning: Failed to get ancestor info for {ancestor_id}: {str(e)}", file=sys.stderr)
-                    # Continue searching other ancestors rather than failing completely
+                        print(f"Warning: Failed to get ancestor info for {ancestry}: {str(e)}", file=sys.stderr)
+                    # Fall through with whatever we got rather than failing completely
+
+            # Rebuild the chain in its original root-to-leaf order and search
+            # it directionally, same as the embedded ancestor list
+            ancestor_chain = [ancestors_by_id[a] for a in ancestor_ids if a in ancestors_by_id]
+            order_name, family_name = find_ranks_in_ancestors(
+                ancestor_chain, include_family, order_name, family_name
+            )
+
+            # The bulk endpoint occasionally omits an ID - fall back to
+            # individual lookups, but only if the ranks are still unresolved
+            if not order_name or (include_family and not family_name):
+                retried = False
+                for ancestor_id in ancestor_ids:
+                    if ancestor_id in ancestors_by_id:
+                        continue
+                    try:
+                        ancestor_info = get_taxon_info(ancestor_id, min_delay)
+                        results = ancestor_info.get('results')
+                        if results:
+                            ancestors_by_id[ancestor_id] = results[0]
+                            taxon_cache[ancestor_id] = results[0]
+                            retried = True
+                    except Exception as e:
+                        if rate_limiter.debug:
+                            print(f"Warning: Failed to get ancestor info for {ancestor_id}: {str(e)}", file=sys.stderr)
+                if retried:
+                    ancestor_chain = [ancestors_by_id[a] for a in ancestor_ids if a in ancestors_by_id]
+                    order_name, family_name = find_ranks_in_ancestors(
+                        ancestor_chain, include_family, order_name, family_name
+                    )
 
         # Return the results
         if not order_name:
@@ -195,29 +475,28 @@ def get_observation_user(observation_id, min_delay=1.0, batch_data=None):
     If batch_data is provided, it will use that instead of making a new API call.
     """
     try:
-        # Use batch data if provided, otherwise make a single API call
+        # Use batch data if provided - an ID the batch response didn't
+        # include falls through to an individual retry below
+        observation = None
         if batch_data:
             # Find the observation in the batch data
-            observation = None
             for result in batch_data.get('results', []):
                 if str(result.get('id')) == str(observation_id):
                     observation = result
                     break
-                    
-            if not observation:
-                return (None, None, "Observation not found in batch data")
-                
-            user = observation.get('user')
-        else:
+
+        if observation is None:
             # Make a single API call for this observation
-            url = f"https://api.inaturalist.org/v1/observations/{observation_id}"
+            url = f"https://api.inaturalist.org/v1/observations/{observation_id}?fields={OBSERVATION_FIELDS}"
             data = make_api_request(url, min_delay)
-            
+
             if not data.get('results') or len(data['results']) == 0:
                 return (None, None, "No results found")
-                
-            user = data['results'][0].get('user')
-            
+
+            observation = data['results'][0]
+
+        user = observation.get('user')
+
         if not user:
             return (None, None, "No user information available")
 
@@ -234,15 +513,59 @@ def get_observation_user(observation_id, min_delay=1.0, batch_data=None):
     except Exception as e:
         return (None, None, f"Error processing observation: {str(e)}")
 
-def read_observation_ids_from_file(file_path):
+def batched(iterable, n):
     """
-    Reads observation IDs from a file, one ID per line.
-    Returns a list of observation IDs.
+    Yields lists of up to n items from any iterable - like slicing a list
+    into chunks, but it works on a generator without materializing it.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+def iter_observation_ids_from_file(file_path, debug=False, resume_from=None):
+    """
+    Streams observation IDs from a file, one ID per line, without ever
+    loading the whole file into memory.
+    Duplicate IDs are skipped (keeping the first occurrence) and lines that
+    aren't numeric are skipped with a warning, so no rate-limit budget gets
+    spent refetching or requesting garbage.
+    If resume_from is given, everything before that ID is discarded while
+    streaming - no list is ever built, so finding the resume point only
+    costs reading the lines up to it.
+    Yields observation IDs in file order.
     """
     try:
+        seen = set()
+        duplicate_count = 0
+        skipping = resume_from is not None
         with open(file_path, 'r') as f:
-            # Strip whitespace and filter out empty lines
-            return [line.strip() for line in f if line.strip()]
+            for line in f:
+                # Strip whitespace and filter out empty lines
+                stripped = line.strip()
+                if not stripped:
+                    continue
+                # While looking for the resume point, skip lines with a bare
+                # string compare - no warnings, no dedup bookkeeping
+                if skipping:
+                    if stripped == resume_from:
+                        skipping = False
+                    else:
+                        continue
+                if not stripped.isdigit():
+                    print(f"Warning: skipping non-numeric observation ID {stripped!r} in {file_path}", file=sys.stderr)
+                    continue
+                if stripped in seen:
+                    duplicate_count += 1
+                    continue
+                seen.add(stripped)
+                yield stripped
+        if skipping:
+            print(f"Warning: resume ID {resume_from} was not found in {file_path}", file=sys.stderr)
+        if debug and duplicate_count > 0:
+            print(f"Removed {duplicate_count} duplicate observation IDs from {file_path}", file=sys.stderr)
     except Exception as e:
         print(f"Error reading file {file_path}: {str(e)}", file=sys.stderr)
         sys.exit(1)
@@ -269,27 +592,57 @@ def main():
                         help='Number of observations to fetch in a single API call (default: 200, max: 200)')
     parser.add_argument('--no-batch', action='store_true',
                         help='Disable batch processing and fetch observations one at a time')
+    parser.add_argument('--top', type=int, default=None, metavar='N',
+                        help='Only show the N most common entries in each summary (default: show all)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of worker threads used to fetch observations (default: 8)')
+    parser.add_argument('--resume-from', metavar='ID',
+                        help='Skip ahead to this observation ID and process from there (useful for restarting an interrupted run)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Clear the persistent API response cache before running (only applies if requests-cache is installed)')
     parser.add_argument('-o', '--outfile', '--out', dest='outfile',
                         help='Write output to the specified file instead of stdout')
 
     args = parser.parse_args()
 
     # Set the rate limiter's delay and debug settings
-    rate_limiter.min_delay = args.delay
+    rate_limiter.set_min_delay(args.delay)
     rate_limiter.debug = args.debug
 
+    # Start from a clean slate if the user doesn't want cached responses
+    if args.no_cache and HAVE_REQUESTS_CACHE:
+        SESSION.cache.clear()
+
     # Cap batch size at 200 (API limit)
     batch_size = min(args.batch_size, 200)
     
-    # Get observation IDs from file if specified, otherwise use command line arguments
+    # Get observation IDs from file if specified, otherwise use command line
+    # arguments.  File input is streamed lazily so a file with millions of
+    # IDs never has to sit in memory all at once; command line input is
+    # already a small list.
     observation_ids = []
+    total_known = None
     if args.file:
-        observation_ids = read_observation_ids_from_file(args.file)
-        if not observation_ids:
+        # --resume-from is handled inside the streaming reader, so skipping
+        # to the resume point costs only the lines read up to it rather than
+        # materializing the file into a list and scanning it
+        id_iter = iter_observation_ids_from_file(args.file, args.debug, args.resume_from)
+        first_id = next(id_iter, None)
+        if first_id is None:
             print(f"No valid observation IDs found in file: {args.file}", file=sys.stderr)
             sys.exit(1)
+        id_iter = chain([first_id], id_iter)
     elif args.observation_ids:
         observation_ids = args.observation_ids
+        if args.resume_from:
+            # Command line input is a small list, so a linear index is fine here
+            try:
+                observation_ids = observation_ids[observation_ids.index(args.resume_from):]
+            except ValueError:
+                print(f"Error: resume ID {args.resume_from} is not among the given observation IDs", file=sys.stderr)
+                sys.exit(1)
+        id_iter = iter(observation_ids)
+        total_known = len(observation_ids)
     else:
         print("Error: You must provide observation IDs either as arguments or with --file", file=sys.stderr)
         parser.print_help()
@@ -298,10 +651,13 @@ def main():
     # Counters for summarizing
     order_counter = Counter()
     unknown_order_count = 0
+    processed_count = 0
 
-    # Organize families by their orders - for the --family summary
-    order_family_map = defaultdict(Counter)
-    unknown_family_by_order = defaultdict(int)
+    # Family counts for the --family summary, keyed by (order, family) tuples -
+    # one flat Counter means one hashed lookup per increment instead of two
+    # and no nested Counter per order.  Observations with a known order but
+    # no family land in the same counter under (order, None)
+    order_family_counter = Counter()
     unknown_family_unknown_order_count = 0
 
     # User tracking - for the --users summary
@@ -319,228 +675,233 @@ def main():
             sys.exit(1)
 
     # Process observations in batches to minimize API calls
-    # Use tqdm progress bar if processing more than 100 observations
-    use_progress_bar = len(observation_ids) > 100
-    
-    if args.no_batch or len(observation_ids) <= 1:
-        # Process one at a time if batch processing is disabled or only one ID
-        # Add progress bar if processing many observations
-        obs_iter = tqdm(observation_ids, desc="Processing observations", file=sys.stderr) if use_progress_bar else observation_ids
-        for obs_id in obs_iter:
+    # Use tqdm progress bar if processing more than 100 observations (when
+    # streaming from a file the total isn't known up front, so batch mode
+    # shows a bar with a running count instead)
+    use_progress_bar = total_known is not None and total_known > 100
+
+    # Per-observation output is buffered and written in chunks rather than
+    # one print per observation - with thousands of IDs the per-line write
+    # and flush overhead adds up
+    out_lines = []
+
+    def flush_output():
+        if out_lines:
+            sys.stdout.write("\n".join(out_lines) + "\n")
+            out_lines.clear()
+
+    def emit(line):
+        out_lines.append(line)
+        # Output is flushed once per batch; this cap just keeps the buffer
+        # bounded on huge no-batch runs
+        if len(out_lines) >= 1000:
+            flush_output()
+
+    # Failed observation IDs are appended to a timestamped file as they
+    # happen (line-buffered), so even if a huge run dies partway through
+    # the list of IDs to retry is already on disk
+    failed_file = None
+
+    def record_failure(obs_id):
+        nonlocal failed_file
+        if failed_file is None:
+            failed_filename = f"failed_observations_{int(time.time())}.txt"
             try:
-                # User information
-                if args.users:
-                    user_name, user_login, user_error = get_observation_user(obs_id, args.delay)
-                    
-                    if user_error:
-                        print(f"{obs_id}: Error - {user_error}")
-                    else:
-                        print(f"{obs_id}: {user_name}: {user_login}")
-                        # Track users for summary
-                        user_counter[user_login] += 1
-                        user_name_map[user_login] = user_name
+                failed_file = open(failed_filename, 'w', buffering=1)
+            except Exception as e:
+                print(f"Warning: could not open {failed_filename}: {str(e)}", file=sys.stderr)
+                failed_file = False
+                return
+            print(f"Saving failed observation IDs to {failed_filename}", file=sys.stderr)
+        if failed_file:
+            failed_file.write(f"{obs_id}\n")
+
+    def fetch_result(obs_id, batch_data=None):
+        """
+        Worker function - does the network I/O for a single observation.
+        Safe to call from a worker thread: the rate limiter has its own
+        lock, and the shared taxon caches are a plain dict (setdefault and
+        item assignment are atomic under the GIL) and an lru_cache (thread-
+        safe).  Anything beyond those needs its own locking.
+        """
+        if args.users:
+            return get_observation_user(obs_id, args.delay, batch_data)
+        return get_observation_taxonomy(obs_id, args.delay, args.family, batch_data)
 
-                # Taxonomy information
+    def process_concurrently(obs_ids, batch_data=None, progress_bar=False):
+        """
+        Fetches a group of observations on a thread pool so their network
+        round trips overlap, then prints the results in the original order
+        on the main thread.  The shared rate limiter still paces how fast
+        the API calls actually go out.
+
+        Counts accumulate in batch-local counters and are merged into the
+        run-level counters once at the end, so the hot loop updates small
+        local dicts instead of the long-lived ones.
+        """
+        nonlocal unknown_order_count, unknown_family_unknown_order_count, processed_count
+        local_orders = Counter()
+        local_families = Counter()
+        local_users = Counter()
+        local_unknown_orders = 0
+        local_unknown_fam_unknown_order = 0
+
+        def handle_result(obs_id, result):
+            """
+            Prints the output line for one observation and updates the
+            batch-local counters.  Always runs on the main thread so the
+            counters don't need any locking.
+            """
+            nonlocal local_unknown_orders, local_unknown_fam_unknown_order
+
+            # User information
+            if args.users:
+                user_name, user_login, user_error = result
+
+                if user_error:
+                    emit(ERROR_LINE % (obs_id, user_error))
+                    record_failure(obs_id)
                 else:
-                    order_name, family_name, error, current_rank, current_rank_name = get_observation_taxonomy(
-                        obs_id, args.delay, args.family
-                    )
-
-                    if error:
-                        if current_rank and current_rank_name:
-                            # Format the rank with first letter capitalized
-                            formatted_rank = current_rank.capitalize()
-                            print(f"{obs_id}: {formatted_rank}: {current_rank_name}")
-                            # Count as unknown for summary
-                            unknown_order_count += 1
-                            if args.family:
-                                unknown_family_unknown_order_count += 1
-                        else:
-                            print(f"{obs_id}: Error - {error}")
-                            # Count errors as unknown
-                            unknown_order_count += 1
-                            if args.family:
-                                unknown_family_unknown_order_count += 1
+                    emit(USER_LINE % (obs_id, user_name, user_login))
+                    # Track users for summary
+                    local_users[user_login] += 1
+                    user_name_map[user_login] = user_name
+
+            # Taxonomy information
+            else:
+                order_name, family_name, error, current_rank, current_rank_name = result
+
+                if error:
+                    if current_rank and current_rank_name:
+                        # Format the rank with first letter capitalized
+                        formatted_rank = current_rank.capitalize()
+                        emit(RANK_LINE % (obs_id, formatted_rank, current_rank_name))
+                        # Count as unknown for summary
+                        local_unknown_orders += 1
+                        if args.family:
+                            local_unknown_fam_unknown_order += 1
                     else:
+                        emit(ERROR_LINE % (obs_id, error))
+                        record_failure(obs_id)
+                        # Count errors as unknown
+                        local_unknown_orders += 1
                         if args.family:
-                            if family_name:
-                                print(f"{obs_id}: Order: {order_name} Family: {family_name}")
-                                # Track families by order
-                                order_family_map[order_name][family_name] += 1
-                            else:
-                                print(f"{obs_id}: Order: {order_name} Family: Unknown")
-                                # Track unknown families by order
-                                unknown_family_by_order[order_name] += 1
+                            local_unknown_fam_unknown_order += 1
+                else:
+                    if args.family:
+                        if family_name:
+                            emit(FAMILY_LINE % (obs_id, order_name, family_name))
+                            # Track families by order
+                            local_families[(order_name, family_name)] += 1
                         else:
-                            print(f"{obs_id}: {order_name}")
+                            emit(FAMILY_UNKNOWN_LINE % (obs_id, order_name))
+                            # Track unknown families under the sentinel key
+                            local_families[(order_name, None)] += 1
+                    else:
+                        emit(ORDER_LINE % (obs_id, order_name))
 
-                        # Add to order counter for summary
-                        order_counter[order_name] += 1
-            except Exception as e:
-                print(f"{obs_id}: Error - Unexpected error: {str(e)}")
-                # Count exceptions as unknown
-                if not args.users:
-                    unknown_order_count += 1
-                    if args.family:
-                        unknown_family_unknown_order_count += 1
-    else:
-        # Process in batches
-        # Create batch ranges with progress bar if needed
-        batch_ranges = list(range(0, len(observation_ids), batch_size))
-        if use_progress_bar:
-            batch_iter = tqdm(batch_ranges, desc="Processing batches", file=sys.stderr)
+                    # Add to order counter for summary
+                    local_orders[order_name] += 1
+
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            futures = [(obs_id, executor.submit(fetch_result, obs_id, batch_data))
+                       for obs_id in obs_ids]
+            future_iter = tqdm(futures, desc="Processing observations", file=sys.stderr) if progress_bar else futures
+            for obs_id, future in future_iter:
+                try:
+                    handle_result(obs_id, future.result())
+                except Exception as e:
+                    emit(ERROR_LINE % (obs_id, f"Unexpected error: {e}"))
+                    record_failure(obs_id)
+                    # Count exceptions as unknown
+                    if not args.users:
+                        local_unknown_orders += 1
+                        if args.family:
+                            local_unknown_fam_unknown_order += 1
+
+        # Merge the batch-local counts into the run-level counters
+        order_counter.update(local_orders)
+        order_family_counter.update(local_families)
+        user_counter.update(local_users)
+        unknown_order_count += local_unknown_orders
+        unknown_family_unknown_order_count += local_unknown_fam_unknown_order
+        processed_count += len(obs_ids)
+
+        # One write per batch keeps the output moving without a syscall
+        # and stdout-lock round trip for every line
+        flush_output()
+
+    if args.no_batch or (total_known is not None and total_known <= 1):
+        # Process one at a time if batch processing is disabled or only one ID
+        if total_known is not None:
+            process_concurrently(observation_ids, progress_bar=use_progress_bar)
         else:
-            batch_iter = batch_ranges
-            
-        for i in batch_iter:
-            batch = observation_ids[i:i+batch_size]
-            
-            if args.debug:
-                print(f"Processing batch of {len(batch)} observations (IDs {i+1}-{i+len(batch)} of {len(observation_ids)})", file=sys.stderr)
-            
-            try:
-                # Fetch the batch of observations
-                batch_data = get_observations_batch(batch, args.delay, batch_size)
-                
-                # Process each observation using the batch data
-                for obs_id in batch:
-                    try:
-                        # User information
-                        if args.users:
-                            user_name, user_login, user_error = get_observation_user(obs_id, args.delay, batch_data)
-                            
-                            if user_error:
-                                print(f"{obs_id}: Error - {user_error}")
-                            else:
-                                print(f"{obs_id}: {user_name}: {user_login}")
-                                # Track users for summary
-                                user_counter[user_login] += 1
-                                user_name_map[user_login] = user_name
-
-                        # Taxonomy information
-                        else:
-                            order_name, family_name, error, current_rank, current_rank_name = get_observation_taxonomy(
-                                obs_id, args.delay, args.family, batch_data
-                            )
-
-                            if error:
-                                if current_rank and current_rank_name:
-                                    # Format the rank with first letter capitalized
-                                    formatted_rank = current_rank.capitalize()
-                                    print(f"{obs_id}: {formatted_rank}: {current_rank_name}")
-                                    # Count as unknown for summary
-                                    unknown_order_count += 1
-                                    if args.family:
-                                        unknown_family_unknown_order_count += 1
-                                else:
-                                    print(f"{obs_id}: Error - {error}")
-                                    # Count errors as unknown
-                                    unknown_order_count += 1
-                                    if args.family:
-                                        unknown_family_unknown_order_count += 1
-                            else:
-                                if args.family:
-                                    if family_name:
-                                        print(f"{obs_id}: Order: {order_name} Family: {family_name}")
-                                        # Track families by order
-                                        order_family_map[order_name][family_name] += 1
-                                    else:
-                                        print(f"{obs_id}: Order: {order_name} Family: Unknown")
-                                        # Track unknown families by order
-                                        unknown_family_by_order[order_name] += 1
-                                else:
-                                    print(f"{obs_id}: {order_name}")
-
-                                # Add to order counter for summary
-                                order_counter[order_name] += 1
-                    except Exception as e:
-                        print(f"{obs_id}: Error - Unexpected error: {str(e)}")
-                        # Count exceptions as unknown
-                        if not args.users:
-                            unknown_order_count += 1
-                            if args.family:
-                                unknown_family_unknown_order_count += 1
-            except Exception as e:
-                print(f"Error processing batch: {str(e)}", file=sys.stderr)
-                # Process the batch one by one as fallback
+            # File input streams through in bounded chunks so memory stays
+            # at O(batch size) even for enormous files.  The total isn't
+            # known up front, so show a running batch count like batch mode
+            for batch in tqdm(batched(id_iter, batch_size), desc="Processing batches", file=sys.stderr):
+                process_concurrently(batch)
+    else:
+        # Process in batches, pulled lazily from the ID source
+        batch_iter = batched(id_iter, batch_size)
+        if total_known is None:
+            batch_iter = tqdm(batch_iter, desc="Processing batches", file=sys.stderr)
+        elif use_progress_bar:
+            batch_iter = tqdm(batch_iter, desc="Processing batches", file=sys.stderr,
+                              total=(total_known + batch_size - 1) // batch_size)
+
+        # Fetch the next batch on a worker thread while the current one is
+        # being processed, so the rate-limited batch requests and the result
+        # handling overlap instead of running back to back
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            def process_batch(batch, batch_future):
                 if args.debug:
-                    print("Falling back to processing one observation at a time", file=sys.stderr)
-                for obs_id in batch:
-                    try:
-                        # User information
-                        if args.users:
-                            user_name, user_login, user_error = get_observation_user(obs_id, args.delay)
-                            
-                            if user_error:
-                                print(f"{obs_id}: Error - {user_error}")
-                            else:
-                                print(f"{obs_id}: {user_name}: {user_login}")
-                                # Track users for summary
-                                user_counter[user_login] += 1
-                                user_name_map[user_login] = user_name
-
-                        # Taxonomy information
-                        else:
-                            order_name, family_name, error, current_rank, current_rank_name = get_observation_taxonomy(
-                                obs_id, args.delay, args.family
-                            )
-
-                            if error:
-                                if current_rank and current_rank_name:
-                                    # Format the rank with first letter capitalized
-                                    formatted_rank = current_rank.capitalize()
-                                    print(f"{obs_id}: {formatted_rank}: {current_rank_name}")
-                                    # Count as unknown for summary
-                                    unknown_order_count += 1
-                                    if args.family:
-                                        unknown_family_unknown_order_count += 1
-                                else:
-                                    print(f"{obs_id}: Error - {error}")
-                                    # Count errors as unknown
-                                    unknown_order_count += 1
-                                    if args.family:
-                                        unknown_family_unknown_order_count += 1
-                            else:
-                                if args.family:
-                                    if family_name:
-                                        print(f"{obs_id}: Order: {order_name} Family: {family_name}")
-                                        # Track families by order
-                                        order_family_map[order_name][family_name] += 1
-                                    else:
-                                        print(f"{obs_id}: Order: {order_name} Family: Unknown")
-                                        # Track unknown families by order
-                                        unknown_family_by_order[order_name] += 1
-                                else:
-                                    print(f"{obs_id}: {order_name}")
-
-                                # Add to order counter for summary
-                                order_counter[order_name] += 1
-                    except Exception as e:
-                        print(f"{obs_id}: Error - Unexpected error: {str(e)}")
-                        # Count exceptions as unknown
-                        if not args.users:
-                            unknown_order_count += 1
-                            if args.family:
-                                unknown_family_unknown_order_count += 1
+                    print(f"Processing batch of {len(batch)} observations (IDs {processed_count+1}-{processed_count+len(batch)})", file=sys.stderr)
+
+                try:
+                    # Fetch the batch of observations
+                    batch_data = batch_future.result()
+
+                    # Process each observation using the batch data
+                    process_concurrently(batch, batch_data)
+                except Exception as e:
+                    print(f"Error processing batch: {str(e)}", file=sys.stderr)
+                    # Process the batch one by one as fallback
+                    if args.debug:
+                        print("Falling back to processing one observation at a time", file=sys.stderr)
+                    process_concurrently(batch)
+
+            pending = None
+            for batch in batch_iter:
+                batch_future = prefetcher.submit(get_observations_batch, batch, args.delay, batch_size)
+                if pending is not None:
+                    process_batch(*pending)
+                pending = (batch, batch_future)
+            if pending is not None:
+                process_batch(*pending)
+
+    # Write out any buffered observation lines before the summaries
+    flush_output()
 
     # Print API call count if requested
     if args.count_api_calls:
         print(f"\nTotal API calls made: {rate_limiter.get_count()}")
 
     # Print summary if more than one observation was processed
-    if len(observation_ids) > 1:
+    if processed_count > 1:
         if args.users:
             # Print user summary
             print("\nSummary by User:")
-            # Sort by count (most to least)
-            for user_login, count in sorted(user_counter.items(), key=lambda x: x[1], reverse=True):
+            # Sorted by count (most to least); most_common uses a partial
+            # sort when --top limits the list
+            for user_login, count in user_counter.most_common(args.top):
                 user_name = user_name_map.get(user_login, "Unknown")
                 print(f"{count:6d}  {user_name} ({user_login})")
         else:
             # Print order summary
             print("\nSummary by Order:")
             # Sort by count (most to least)
-            for order, count in sorted(order_counter.items(), key=lambda x: x[1], reverse=True):
+            for order, count in order_counter.most_common(args.top):
                 print(f"{count:6d}  {order}")
 
             # Add unknown order count if any
@@ -549,21 +910,40 @@ def main():
 
             # Add family summary if requested
             if args.family:
+                # Group the flat (order, family) counts by order in one pass;
+                # the (order, None) sentinel entries carry the unknown-family
+                # counts and are split out for printing last
+                families_by_order = defaultdict(list)
+                unknown_family_by_order = {}
+                for (order, family), count in order_family_counter.items():
+                    if family is None:
+                        unknown_family_by_order[order] = count
+                    else:
+                        families_by_order[order].append((family, count))
+
                 # For each order, print its family summary
                 for order in sorted(order_counter.keys()):
                     print(f"\nFamilies within {order}:")
                     # Sort families within this order by count
-                    for family, count in sorted(order_family_map[order].items(), key=lambda x: x[1], reverse=True):
+                    if args.top is not None:
+                        family_counts = heapq.nlargest(args.top, families_by_order[order], key=lambda x: x[1])
+                    else:
+                        family_counts = sorted(families_by_order[order], key=lambda x: x[1], reverse=True)
+                    for family, count in family_counts:
                         print(f"{count:6d}  {family}")
 
                     # Add unknown family count for this order if any
-                    if unknown_family_by_order[order] > 0:
+                    if unknown_family_by_order.get(order, 0) > 0:
                         print(f"{unknown_family_by_order[order]:6d}  Unknown family")
 
                 # Print summary for observations with unknown orders but known families (unlikely but possible)
                 if unknown_family_unknown_order_count > 0:
                     print(f"\nUnknown families within unknown orders: {unknown_family_unknown_order_count}")
     
+    # Close the failed-IDs file if any failures were recorded
+    if failed_file:
+        failed_file.close()
+
     # Close output file if it was used
     if output_file:
         output_file.close()